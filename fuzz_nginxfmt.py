@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Differential fuzzing and throughput-regression harness for nginxfmt.
+
+Generates random nginx configs from a small grammar, formats them with the reference engine (nginxfmt.Formatter)
+and optionally with alternative engines, checks that formatting is idempotent and that all engines agree,
+and records per-input timings so inputs with pathological performance are reported.
+
+Alternative engine is passed as module:ClassName, the class is instantiated with FormatterOptions and has to provide
+format_string() method, like nginxfmt.Formatter subclasses do.
+"""
+
+import argparse
+import importlib
+import random
+import statistics
+import sys
+import time
+
+import nginxfmt
+
+__author__ = "Michał Słomkowski"
+__license__ = "Apache 2.0"
+
+
+class ConfigGenerator:
+    """Generates random, mostly valid nginx configs. Some inputs are deliberately odd (multiple statements in a line,
+    K&R braces, quoted brackets and semicolons, template variables, minified blocks), since these are the cases
+    handled by special code paths of the formatter."""
+    _BLOCKS = ('http', 'server', 'location /', 'location ~ /\\.ht', 'location = /favicon.ico', 'upstream backend',
+               'if ($request_method = POST)', 'map $http_upgrade $connection_upgrade', 'events', 'types')
+    _DIRECTIVES = ('listen', 'server_name', 'root', 'index', 'proxy_pass', 'proxy_set_header', 'return', 'rewrite',
+                   'allow', 'deny', 'add_header', 'access_log', 'error_page', 'try_files', 'log_format', 'set')
+    _WORDS = ('80', '443 ssl', 'example.com', '*.example.org', '/var/www', 'index.html', 'http://backend',
+              'Host $host', '301 https://$host$request_uri', '^/old/(.*)$ /new/$1 last', '127.0.0.1', 'all',
+              '10.0.0.0/8', 'off', '$uri $uri/ =404', '404 /404.html', '$var value', '"~^(?<x>[0-9a-f]{8})$"')
+    _QUOTED = ('"a b  c"', "'x; y'", '"{json: 1}"', "'h3=\":443\"; ma=86400'", '"${var}"', '"tab\there"',
+               '"braces } and { inside"', "'{\"time\":\"$time_iso8601\"}'")
+    _COMMENTS = ('# comment', '#    spaced   comment', '# brace { in comment', '# ${template} in comment', '#')
+
+    def __init__(self, seed: int, max_depth: int = 4):
+        self.random = random.Random(seed)
+        self.max_depth = max_depth
+
+    def generate(self) -> str:
+        r = self.random
+        text = self._block_body(0)
+        if r.random() < 0.1:
+            text = text.replace('\n', ' ')
+        if r.random() < 0.2:
+            text = text.replace('\n', '\r\n')
+        return text
+
+    def _space(self) -> str:
+        return self.random.choice((' ', ' ', '  ', '\t', ' \t '))
+
+    def _statement(self) -> str:
+        r = self.random
+        words = [r.choice(self._DIRECTIVES)]
+        for _ in range(r.randint(0, 3)):
+            words.append(r.choice(self._QUOTED) if r.random() < 0.25 else r.choice(self._WORDS))
+        if r.random() < 0.1:
+            words.append('${ %s }' % r.choice(('a', 'var', 'other_var')))
+        return self._space().join(words) + ';'
+
+    def _block_body(self, depth: int) -> str:
+        r = self.random
+        lines = []
+        for _ in range(r.randint(0, 6)):
+            choice = r.random()
+            if choice < 0.1:
+                lines.append(r.choice(self._COMMENTS))
+            elif choice < 0.15:
+                lines.append('')
+            elif choice < 0.25:
+                lines.append(self._space().join(self._statement() for _ in range(r.randint(2, 4))))
+            elif choice < 0.45 and depth < self.max_depth:
+                opening = r.choice((' {', '{', '\n{', '  {  '))
+                lines.append(r.choice(self._BLOCKS) + opening + '\n' + self._block_body(depth + 1) + '\n}')
+            else:
+                lines.append(self._statement())
+            if r.random() < 0.1:
+                lines[-1] += ' ' + r.choice(self._COMMENTS)
+        indent = ' ' * r.randint(0, 6)
+        return '\n'.join(indent + line for line in lines)
+
+
+def make_minified_config(size: int) -> str:
+    """Returns http block with server blocks repeated until given size is reached, all in a single line. Vendors ship
+    configs like that and they used to be the worst case for the formatter."""
+    server = ('server { listen 443 ssl; server_name example.com; add_header Alt-Svc \'h3=":443"; ma=86400\'; '
+              'location / { proxy_pass http://backend; proxy_set_header Host $host; } '
+              'location ~ /\\.ht { deny all; } } ')
+    return 'http { ' + server * max(1, size // len(server)) + '}'
+
+
+class Measurement:
+    """Result of formatting single input with single engine."""
+
+    def __init__(self, engine_name: str, input_index: int, input_size: int):
+        self.engine_name = engine_name
+        self.input_index = input_index
+        self.input_size = input_size
+        self.duration = 0.0
+        self.output = None
+        self.error = None
+
+
+def _format_timed(engine_name: str, engine, input_index: int, text: str) -> Measurement:
+    measurement = Measurement(engine_name, input_index, len(text))
+    started = time.perf_counter()
+    try:
+        measurement.output = engine.format_string(text)
+    except Exception as e:
+        measurement.error = e
+    measurement.duration = time.perf_counter() - started
+    return measurement
+
+
+def run_differential(engines: dict, inputs: list) -> (list, list):
+    """Formats all inputs with all engines. Checks idempotence of every engine and equivalence of every engine with
+    the first one.
+    :param engines: dictionary engine name -> object with format_string() method. First one is the reference.
+    :param inputs: list of config strings.
+    :return: list of problems found (as strings) and list of measurements."""
+    problems = []
+    measurements = []
+    reference_name = next(iter(engines))
+
+    for index, text in enumerate(inputs):
+        outputs = {}
+        for name, engine in engines.items():
+            measurement = _format_timed(name, engine, index, text)
+            measurements.append(measurement)
+            if measurement.error is not None:
+                problems.append("input %d: %s raised %r" % (index, name, measurement.error))
+                continue
+            outputs[name] = measurement.output
+
+            second_pass = _format_timed(name, engine, index, measurement.output)
+            if second_pass.error is not None or second_pass.output != measurement.output:
+                problems.append("input %d: %s is not idempotent" % (index, name))
+
+        for name, output in outputs.items():
+            if name != reference_name and reference_name in outputs and output != outputs[reference_name]:
+                problems.append("input %d: %s differs from %s" % (index, name, reference_name))
+
+    return problems, measurements
+
+
+def find_slow_inputs(measurements: list, factor: float = 10.0, min_duration: float = 0.01) -> list:
+    """Returns measurements, which per-character formatting time exceeds the median of given engine by the factor.
+    Very short runs are ignored, since their timing is dominated by noise."""
+    slow = []
+    for engine_name in {m.engine_name for m in measurements}:
+        engine_measurements = [m for m in measurements if m.engine_name == engine_name and m.input_size > 0]
+        if not engine_measurements:
+            continue
+        median_rate = statistics.median(m.duration / m.input_size for m in engine_measurements)
+        slow.extend(m for m in engine_measurements
+                    if m.duration >= min_duration and m.duration / m.input_size > factor * median_rate)
+    return slow
+
+
+def measure_scaling(engine, make_input, sizes=(1000, 2000, 4000, 8000), repeat: int = 3) -> list:
+    """Formats inputs of growing size and returns list of (size, best duration) tuples. For linear implementation,
+    doubling the size doubles the duration.
+    :param make_input: function returning config of approximately given size in characters."""
+    results = []
+    for size in sizes:
+        text = make_input(size)
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            engine.format_string(text)
+            durations.append(time.perf_counter() - started)
+        results.append((len(text), min(durations)))
+    return results
+
+
+def _load_engine(spec: str, options: nginxfmt.FormatterOptions):
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)(options)
+
+
+def _check_scaling(engines: dict) -> int:
+    sizes = (25000, 50000, 100000, 200000, 400000)
+    failed = False
+    for name, engine in engines.items():
+        results = measure_scaling(engine, make_minified_config, sizes)
+        for (previous_size, previous_duration), (size, duration) in zip(results, results[1:]):
+            # linear implementation gives ratio ~2 per doubling, quadratic one ~4
+            ratio = duration / max(previous_duration, 1e-9)
+            failed = failed or ratio > 3.0
+            print("%s: %d characters in %.3f s, %.2fx time for %.2fx size"
+                  % (name, size, duration, ratio, size / previous_size))
+    return 1 if failed else 0
+
+
+def main(program_arguments=None):
+    arg_parser = argparse.ArgumentParser(description="Runs differential fuzzing of nginx config formatter.")
+    arg_parser.add_argument("--seed", type=int, default=0, help="seed of the first generated input")
+    arg_parser.add_argument("-n", "--count", type=int, default=1000, help="number of inputs to generate")
+    arg_parser.add_argument("--candidate", action="append", default=[], metavar="MODULE:CLASS",
+                            help="alternative engine compared against nginxfmt.Formatter, can be repeated")
+    arg_parser.add_argument("--scaling", action="store_true",
+                            help="instead of fuzzing, check that formatting time of minified configs grows linearly")
+    arg_parser.add_argument("--slow-factor", type=float, default=10.0,
+                            help="report inputs formatted this many times slower per character than the median")
+    args = arg_parser.parse_args(program_arguments)
+
+    options = nginxfmt.FormatterOptions()
+    options.line_endings = '\n'
+    engines = {'nginxfmt.Formatter': nginxfmt.Formatter(options)}
+    for spec in args.candidate:
+        engines[spec] = _load_engine(spec, options)
+
+    if args.scaling:
+        return _check_scaling(engines)
+
+    inputs = [ConfigGenerator(seed).generate() for seed in range(args.seed, args.seed + args.count)]
+    problems, measurements = run_differential(engines, inputs)
+
+    for problem in problems:
+        print(problem)
+    for m in find_slow_inputs(measurements, args.slow_factor):
+        print("input %d: %s took %.3f s for %d characters" % (m.input_index, m.engine_name, m.duration, m.input_size))
+
+    for name in engines:
+        engine_measurements = [m for m in measurements if m.engine_name == name]
+        total_size = sum(m.input_size for m in engine_measurements)
+        total_duration = sum(m.duration for m in engine_measurements)
+        print("%s: %d inputs, %d characters, %.3f s, %.0f characters/s"
+              % (name, len(engine_measurements), total_size, total_duration, total_size / max(total_duration, 1e-9)))
+
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,13 +8,33 @@ then moved to https://github.com/slomkowski/nginx-config-formatter.
 """
 
 import argparse
+import collections
+import concurrent.futures
 import contextlib
+import ctypes
+import ctypes.util
+import fnmatch
 import io
+import itertools
+import json
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
 import pathlib
 import re
+import select
+import shutil
+import struct
 import sys
+import tempfile
+import threading
+import time
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    resource_tracker = shared_memory = None
 
 __author__ = "Michał Słomkowski"
 __license__ = "Apache 2.0"
@@ -22,9 +42,253 @@ __version__ = "1.3.0"
 
 
 class FormatterOptions:
-    """Class holds the formatting options. For now, only indentation supported."""
+    """Class holds the formatting options: indentation, line endings and size of chunks the output is written in."""
     indentation = 4
     line_endings = os.linesep
+    write_buffer_size = 64 * 1024
+
+
+class FileStatistics:
+    """Measurements collected while formatting a single file, used by the run report."""
+
+    def __init__(self, file_path: str):
+        self.file_path = str(file_path)
+        self.encoding = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lines_in = 0
+        self.lines_out = 0
+        self.changed = False
+        self.read_time = 0.0
+        self.format_time = 0.0
+        self.write_time = 0.0
+        self.error = None
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def _count_lines(text: str) -> int:
+    if not text:
+        return 0
+    return text.count('\n') + (0 if text.endswith('\n') else 1)
+
+
+class RunReport:
+    """Aggregates statistics of all files formatted in a single run. Can be exported as JSON document or as metrics
+    file for Prometheus node exporter textfile collector."""
+    _METRICS_PREFIX = 'nginxfmt_last_run_'
+
+    def __init__(self):
+        self.files = []
+        self._started = time.monotonic()
+
+    def add(self, stats: FileStatistics):
+        self.files.append(stats)
+
+    def totals(self) -> dict:
+        return {
+            'files': len(self.files),
+            'files_changed': sum(1 for f in self.files if f.changed),
+            'files_failed': sum(1 for f in self.files if f.error is not None),
+            'bytes_in': sum(f.bytes_in for f in self.files),
+            'bytes_out': sum(f.bytes_out for f in self.files),
+            'lines_in': sum(f.lines_in for f in self.files),
+            'lines_out': sum(f.lines_out for f in self.files),
+            'read_time': sum(f.read_time for f in self.files),
+            'format_time': sum(f.format_time for f in self.files),
+            'write_time': sum(f.write_time for f in self.files),
+            'duration': time.monotonic() - self._started,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps({'files': [f.as_dict() for f in self.files], 'totals': self.totals()}, indent=2)
+
+    def to_prometheus(self) -> str:
+        metrics = []
+        for name, value in self.totals().items():
+            if name.endswith('time') or name == 'duration':
+                name += '_seconds'
+            metrics.append('# TYPE %s%s gauge\n%s%s %s\n' % (self._METRICS_PREFIX, name,
+                                                               self._METRICS_PREFIX, name, value))
+        metrics.append('# TYPE %stimestamp_seconds gauge\n%stimestamp_seconds %s\n' % (self._METRICS_PREFIX,
+                                                                                       self._METRICS_PREFIX,
+                                                                                       time.time()))
+        return ''.join(metrics)
+
+    def write_prometheus_textfile(self, file_path: pathlib.Path):
+        """Writes the metrics atomically, so the collector never reads partially written file."""
+        tmp_file_path = file_path.with_name(file_path.name + '.tmp')
+        tmp_file_path.write_text(self.to_prometheus(), encoding='utf-8')
+        os.replace(str(tmp_file_path), str(file_path))
+
+
+class _BufferedWriter:
+    """Collects the written text and passes it to the stream in chunks of at least buffer_size characters. Text is
+    encoded if encoding is given, then the stream has to be binary. If the original text is given, the writer checks
+    on the fly whether the output differs from it."""
+
+    def __init__(self, stream, buffer_size: int, encoding: str = None, original: str = None):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self.written = 0
+        self.write_time = 0.0
+        self._original = original
+        self._original_position = 0
+        self._differs = False
+        self._chunks = []
+        self._buffered = 0
+
+    def write(self, text: str):
+        self._chunks.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._chunks:
+            return
+        text = ''.join(self._chunks)
+        self._chunks = []
+        self._buffered = 0
+
+        if self._original is not None and not self._differs:
+            self._differs = not self._original.startswith(text, self._original_position)
+            self._original_position += len(text)
+
+        started = time.perf_counter()
+        data = text.encode(self.encoding) if self.encoding else text
+        self.stream.write(data)
+        self.write_time += time.perf_counter() - started
+        self.written += len(data)
+
+    def differs_from_original(self) -> bool:
+        return self._differs or self._original_position != len(self._original)
+
+
+class _IndexedBlock:
+    """Block opened in the config, as seen by ConfigIndex."""
+
+    def __init__(self, name: str, args: str, location: str):
+        self.name = name
+        self.args = args
+        self.location = location
+        self.server_names = []
+        self.listen = []
+        self.child_locations = {}
+
+
+class ConfigIndex:
+    """Index of server names, listen addresses, locations and upstreams across all the files formatted in a run.
+    It's fed with the formatted lines as they are written, so it costs little over formatting alone. Places in the
+    configs are stored as 'file:line' strings, line numbers refer to the formatted file."""
+    DEFAULT_LISTEN = '*:80'
+
+    def __init__(self):
+        self.server_names = collections.defaultdict(list)
+        self.listen = collections.defaultdict(list)
+        self.upstreams = collections.defaultdict(list)
+        self.duplicate_locations = []
+        self._server_name_listen = collections.defaultdict(list)
+        self._stack = []
+
+    def add_line(self, file_path: str, line_number: int, line: str):
+        """Indexes single formatted line. Lines have to be passed in order, file by file."""
+        line = line.strip()
+        if line.startswith('#') or line == '':
+            return
+        location = '%s:%d' % (file_path, line_number)
+
+        if line.endswith('{'):
+            name, _, args = line[:-1].strip().partition(' ')
+            block = _IndexedBlock(name, args.strip(), location)
+            if name == 'location' and self._stack:
+                parent = self._stack[-1]
+                if block.args in parent.child_locations:
+                    self.duplicate_locations.append((block.args, [parent.child_locations[block.args], location]))
+                else:
+                    parent.child_locations[block.args] = location
+            elif name == 'upstream':
+                self.upstreams[block.args].append(location)
+            self._stack.append(block)
+        elif line.endswith('}'):
+            if self._stack:
+                self._close_block(self._stack.pop())
+        elif self._stack and self._stack[-1].name == 'server':
+            directive, _, args = self._strip_statement_end(line).partition(' ')
+            if directive == 'server_name':
+                self._stack[-1].server_names.extend(args.split())
+            elif directive == 'listen' and args:
+                self._stack[-1].listen.append(self._normalize_listen(args.split()[0]))
+
+    @staticmethod
+    def _strip_statement_end(line: str) -> str:
+        """Cuts the directive at the first semicolon or comment outside quotation marks."""
+        quote_char = None
+        for position, char in enumerate(line):
+            if quote_char is not None:
+                if char == quote_char:
+                    quote_char = None
+            elif char in ['"', "'"]:
+                quote_char = char
+            elif char in [';', '#']:
+                return line[:position].strip()
+        return line.strip()
+
+    def finish_file(self):
+        """Closes the blocks left open at the end of the file."""
+        while self._stack:
+            self._close_block(self._stack.pop())
+
+    def _close_block(self, block: _IndexedBlock):
+        if block.name != 'server':
+            return
+        for listen in block.listen or [self.DEFAULT_LISTEN]:
+            self.listen[listen].append(block.location)
+            for server_name in block.server_names:
+                self._server_name_listen[(server_name, listen)].append(block.location)
+        for server_name in block.server_names:
+            self.server_names[server_name].append(block.location)
+
+    @staticmethod
+    def _normalize_listen(address: str) -> str:
+        if address.isdigit():
+            return '*:' + address
+        return address
+
+    def duplicate_server_names(self) -> list:
+        """Returns list of (server name, listen address, places of the server blocks) for server names defined in
+        more than one server block listening on the same address. nginx uses only the first one."""
+        return [(server_name, listen, locations)
+                for (server_name, listen), locations in sorted(self._server_name_listen.items())
+                if len(locations) > 1]
+
+    def duplicate_upstreams(self) -> list:
+        """Returns list of (upstream name, places) for upstreams defined more than once."""
+        return [(name, locations) for name, locations in sorted(self.upstreams.items()) if len(locations) > 1]
+
+    def update(self, other: 'ConfigIndex'):
+        """Adds contents of other index, built from different files."""
+        for mapping, other_mapping in ((self.server_names, other.server_names),
+                                       (self.listen, other.listen),
+                                       (self.upstreams, other.upstreams),
+                                       (self._server_name_listen, other._server_name_listen)):
+            for key, locations in other_mapping.items():
+                mapping[key].extend(locations)
+        self.duplicate_locations.extend(other.duplicate_locations)
+
+    def report(self) -> str:
+        lines = []
+        for server_name, listen, locations in self.duplicate_server_names():
+            lines.append("duplicate server_name %s on %s: %s" % (server_name, listen, ', '.join(locations)))
+        for args, locations in self.duplicate_locations:
+            lines.append("duplicate location %s: %s" % (args, ', '.join(locations)))
+        for name, locations in self.duplicate_upstreams():
+            lines.append("duplicate upstream %s: %s" % (name, ', '.join(locations)))
+        lines.append("indexed %d server names, %d listen addresses, %d upstreams"
+                     % (len(self.server_names), len(self.listen), len(self.upstreams)))
+        return '\n'.join(lines)
 
 
 class Formatter:
@@ -35,6 +299,8 @@ class Formatter:
     _TEMPLATE_BRACKET_OPENING_TAG = '___TEMPLATE_BRACKET_OPENING_TAG___'
     _TEMPLATE_BRACKET_CLOSING_TAG = '___TEMPLATE_BRACKET_CLOSING_TAG___'
 
+    _QUOTE_MARK_REGEX = re.compile(r'(?<!\\)([\'"])')
+
     def __init__(self,
                  options: FormatterOptions = FormatterOptions(),
                  logger: logging.Logger = None):
@@ -45,54 +311,108 @@ class Formatter:
                       contents: str) -> str:
         """Accepts the string containing nginx configuration and returns formatted one. Adds newline at the end."""
         ls = self.options.line_endings
+        return ls.join(self._iter_formatted_lines(contents)) + ls
+
+    def write_formatted(self,
+                        contents: str,
+                        stream,
+                        encoding: str = None,
+                        stats: FileStatistics = None,
+                        index: ConfigIndex = None):
+        """Formats the config and writes it to the stream line by line, in chunks of options.write_buffer_size
+        characters, so the formatted config is never held in memory as a whole.
+        :param stream: text stream, or binary stream if encoding is given.
+        :param encoding: encoding of the output written to binary stream.
+        :param stats: optional object filled with measurements of formatting and writing. Written size is in bytes for
+        binary streams and in characters for text ones.
+        :param index: optional index, formatted lines are added to it under the file path from stats."""
+        stats = stats if stats is not None else FileStatistics(getattr(stream, 'name', '<stream>'))
+        ls = self.options.line_endings
+        writer = _BufferedWriter(stream, self.options.write_buffer_size, encoding, contents)
+
+        started = time.perf_counter()
+        lines_out = 0
+        for line in self._iter_formatted_lines(contents):
+            writer.write(line)
+            writer.write(ls)
+            lines_out += 1
+            if index is not None:
+                index.add_line(stats.file_path, lines_out, line)
+        if index is not None:
+            index.finish_file()
+        if lines_out == 0:
+            writer.write(ls)
+            lines_out = 1
+        writer.flush()
+
+        stats.write_time = writer.write_time
+        stats.format_time = time.perf_counter() - started - writer.write_time
+        stats.lines_in = _count_lines(contents)
+        stats.lines_out = lines_out
+        stats.bytes_out = writer.written
+        stats.changed = writer.differs_from_original()
+
+    def _iter_formatted_lines(self, contents: str):
         lines = contents.splitlines()
         lines = self._apply_bracket_template_tags(lines)
         lines = self._clean_lines(lines)
         lines = self._join_opening_bracket(lines)
         lines = self._perform_indentation(lines)
 
-        text = ls.join(lines)
-        text = self._strip_bracket_template_tags(text)
-
-        for pattern, substitute in (
-                (r'%s{3,}' % ls, '%s%s%s' % (ls, ls, ls)),
-                (r'^%s' % ls, ''),
-                (r'%s$' % ls, '')
-        ):
-            text = re.sub(pattern, substitute, text)
-
-        return text + ls
+        for line in self._collapse_empty_lines(lines):
+            yield self._strip_bracket_template_tags(line)
 
     def get_formatted_string_from_file(self,
-                                       file_path: pathlib.Path) -> str:
+                                       file_path: pathlib.Path,
+                                       stats: FileStatistics = None) -> str:
         """Loads nginx config from file, performs formatting and returns contents as string.
-        :param file_path: path to original nginx configuration file."""
+        :param file_path: path to original nginx configuration file.
+        :param stats: optional object filled with measurements of reading and formatting."""
 
-        _, original_file_content = self._load_file_content(file_path)
-        return self.format_string(original_file_content)
+        stats = stats if stats is not None else FileStatistics(file_path)
+        _, original_file_content = self._load_file_content_measured(file_path, stats)
+        output = io.StringIO(newline='')
+        self.write_formatted(original_file_content, output, stats=stats)
+        return output.getvalue()
 
     def format_file(self,
                     file_path: pathlib.Path,
-                    original_backup_file_path: pathlib.Path = None):
+                    original_backup_file_path: pathlib.Path = None,
+                    stats: FileStatistics = None,
+                    index: ConfigIndex = None):
         """Performs the formatting on the given file. The function tries to detect file encoding first.
         :param file_path: path to original nginx configuration file. This file will be overridden.
-        :param original_backup_file_path: optional path, where original file will be backed up."""
+        :param original_backup_file_path: optional path, where original file will be backed up.
+        :param stats: optional object filled with measurements of reading, formatting and writing.
+        :param index: optional index, to which servers, locations and upstreams from the file are added."""
 
-        chosen_encoding, original_file_content = self._load_file_content(file_path)
+        stats = stats if stats is not None else FileStatistics(file_path)
+        chosen_encoding, original_file_content = self._load_file_content_measured(file_path, stats)
 
-        with file_path.open('w', encoding=chosen_encoding) as wfp:
-            wfp.write(self.format_string(original_file_content))
+        with file_path.open('wb') as wfp:
+            self.write_formatted(original_file_content, wfp, chosen_encoding, stats, index)
 
         self.logger.info("Formatted content written to original file.")
 
         if original_backup_file_path:
-            with original_backup_file_path.open('w', encoding=chosen_encoding) as wfp:
+            with original_backup_file_path.open('w', encoding=chosen_encoding, newline='') as wfp:
                 wfp.write(original_file_content)
             self.logger.info("Original content saved to '%s'.", original_backup_file_path)
 
+    def _load_file_content_measured(self,
+                                    file_path: pathlib.Path,
+                                    stats: FileStatistics) -> (str, str):
+        started = time.perf_counter()
+        chosen_encoding, original_file_content = self._load_file_content(file_path)
+        stats.read_time = time.perf_counter() - started
+        stats.encoding = chosen_encoding
+        stats.bytes_in = file_path.stat().st_size
+        return chosen_encoding, original_file_content
+
     def _load_file_content(self,
                            file_path: pathlib.Path) -> (str, str):
-        """Determines the encoding of the input file and loads its content to string.
+        """Determines the encoding of the input file and loads its content to string. Line endings are kept as they
+        are, so the formatted content can be compared with the original.
         :param file_path: path to original nginx configuration file."""
 
         encodings = ('utf-8', 'latin1')
@@ -102,7 +422,7 @@ class Formatter:
 
         for enc in encodings:
             try:
-                with file_path.open('r', encoding=enc) as rfp:
+                with file_path.open('r', encoding=enc, newline='') as rfp:
                     original_file_content = rfp.read()
                 chosen_encoding = enc
                 break
@@ -125,6 +445,8 @@ class Formatter:
         single_line = single_line.strip()
         if single_line.startswith('#'):
             return single_line
+        if '"' not in single_line and "'" not in single_line:
+            return ' '.join(single_line.split())
 
         within_quotes = False
         quote_char = None
@@ -139,7 +461,7 @@ class Formatter:
                     within_quotes = True
                     quote_char = char
                 result.append(char)
-            elif not within_quotes and re.match(r'\s', char):
+            elif not within_quotes and char.isspace():
                 if result[-1] != ' ':
                     result.append(' ')
             else:
@@ -215,39 +537,20 @@ class Formatter:
         formatted_lines = []
 
         for line in lines:
-            formatted_line = ""
-            in_quotes = False
-            last_char = ""
-
-            if line.startswith('#'):
-                formatted_line += line
-            else:
-                for char in line:
-                    if (char == "\'" or char == "\"") and last_char != "\\":
-                        in_quotes = self._reverse_in_quotes_status(in_quotes)
-
-                    if in_quotes:
-                        if char == "{":
-                            formatted_line += self._TEMPLATE_BRACKET_OPENING_TAG
-                        elif char == "}":
-                            formatted_line += self._TEMPLATE_BRACKET_CLOSING_TAG
-                        else:
-                            formatted_line += char
-                    else:
-                        formatted_line += char
-
-                    last_char = char
-
-            formatted_lines.append(formatted_line)
+            if line.startswith('#') or ('{' not in line and '}' not in line):
+                formatted_lines.append(line)
+                continue
+
+            # the capturing split puts each unescaped quotation mark in its own odd segment; every mark toggles
+            # the in-quotes state, so the text segments 2, 6, 10, ... are within quotes
+            segments = self._QUOTE_MARK_REGEX.split(line)
+            for i in range(2, len(segments), 4):
+                segments[i] = segments[i].replace("{", self._TEMPLATE_BRACKET_OPENING_TAG) \
+                    .replace("}", self._TEMPLATE_BRACKET_CLOSING_TAG)
+            formatted_lines.append(''.join(segments))
 
         return formatted_lines
 
-    @staticmethod
-    def _reverse_in_quotes_status(status: bool) -> bool:
-        if status:
-            return False
-        return True
-
     def _strip_bracket_template_tags(self, content: str) -> str:
         """ Replaces tags back with { and } respectively."""
         content = content.replace(self._TEMPLATE_BRACKET_OPENING_TAG, "{", -1)
@@ -255,9 +558,13 @@ class Formatter:
         return content
 
     def _clean_lines(self, orig_lines) -> list:
-        """Strips the lines and splits them if they contain curly brackets."""
+        """Strips the lines and splits them if they contain curly brackets. Lines with multiple statements are split
+        into parts, which are put back on the stack of pending lines instead of being processed recursively, so
+        minified configs of any length are handled in linear time."""
         cleaned_lines = []
-        for line in orig_lines:
+        pending_lines = list(reversed(orig_lines))
+        while pending_lines:
+            line = pending_lines.pop()
             line = self._strip_line(line)
             line = self._apply_variable_template_tags(line)
             if line == "":
@@ -270,11 +577,10 @@ class Formatter:
                 q, c = self._count_multi_semicolon(line)
                 if q == 1 and c > 1:
                     ml = self._multi_semicolon(line)
-                    cleaned_lines.extend(self._clean_lines(ml.splitlines()))
+                    pending_lines.extend(reversed(ml.splitlines()))
                 elif q != 1 and c > 1:
                     newlines = line.split(";")
-                    lines_to_add = self._clean_lines(["".join([ln, ";"]) for ln in newlines if ln != ""])
-                    cleaned_lines.extend(lines_to_add)
+                    pending_lines.extend(reversed(["".join([ln, ";"]) for ln in newlines if ln != ""]))
                 else:
                     if line.startswith("rewrite"):
                         cleaned_lines.append(self._strip_variable_template_tags(line))
@@ -284,6 +590,26 @@ class Formatter:
                              ln != ""])
         return cleaned_lines
 
+    @staticmethod
+    def _collapse_empty_lines(lines):
+        """Collapses neighbouring empty lines to at most two. Empty lines at the beginning of the config are collapsed
+        to at most one and at the end of the config, all but the third one are removed."""
+        empty_lines = 0
+        content_seen = False
+        for line in lines:
+            if line == "":
+                empty_lines += 1
+                continue
+            if content_seen:
+                yield from itertools.repeat("", min(empty_lines, 2))
+            else:
+                yield from itertools.repeat("", max(0, min(empty_lines, 3) - 1))
+            empty_lines = 0
+            content_seen = True
+            yield line
+        if content_seen:
+            yield from itertools.repeat("", max(0, min(empty_lines, 3) - 2))
+
     @staticmethod
     def _join_opening_bracket(lines):
         """When opening curly bracket is in it's own line (K&R convention), it's joined with precluding line (Java)."""
@@ -315,6 +641,642 @@ class Formatter:
         return indented_lines
 
 
+def _pool_worker(options: FormatterOptions, connection):
+    """Main loop of FormatterPool worker process. Reads the config from the shared memory block created by the pool
+    and returns the formatted one in a new block, which is released by the pool."""
+    formatter = Formatter(options)
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        task_id, input_name, input_size = task
+        try:
+            input_shm = shared_memory.SharedMemory(name=input_name)
+            try:
+                contents = str(input_shm.buf[:input_size], 'utf-8')
+            finally:
+                input_shm.close()
+
+            formatted_contents = formatter.format_string(contents).encode('utf-8')
+            del contents
+            output_shm = shared_memory.SharedMemory(create=True, size=max(1, len(formatted_contents)))
+            output_shm.buf[:len(formatted_contents)] = formatted_contents
+            output_shm.close()
+            connection.send((task_id, output_shm.name, len(formatted_contents), None))
+        except Exception as e:
+            connection.send((task_id, None, 0, '%s: %s' % (type(e).__name__, e)))
+
+
+class _PoolWorker:
+    """Worker process of FormatterPool with its own pipe, so a dead worker affects only the task it was given."""
+
+    def __init__(self, options: FormatterOptions):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_pool_worker, args=(options, child_connection), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.task_id = None
+
+
+class FormatterPool:
+    """Formats configs in parallel using pre-started worker processes, which keep their Formatter between the tasks.
+    Contents are passed to and from the workers through shared memory blocks instead of being pickled. Number of
+    submitted, but not finished tasks is limited, so submit() blocks when the workers can't keep up. Worker which
+    dies is replaced, only the task it was working on fails.
+
+    Requires Python 3.8 or later."""
+
+    def __init__(self,
+                 options: FormatterOptions = FormatterOptions(),
+                 processes: int = None,
+                 max_pending: int = None):
+        """
+        :param options: formatting options used by all workers.
+        :param processes: number of worker processes, number of CPUs by default.
+        :param max_pending: maximal number of unfinished tasks, twice the number of processes by default."""
+        if shared_memory is None:
+            raise Exception("FormatterPool requires multiprocessing.shared_memory, available in Python 3.8+")
+
+        processes = processes if processes else (os.cpu_count() or 1)
+        self._options = options
+        self._semaphore = threading.BoundedSemaphore(max_pending if max_pending else 2 * processes)
+        self._pending = {}
+        self._waiting = collections.deque()
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._closed = False
+        self._wakeup_receiver, self._wakeup_sender = multiprocessing.Pipe(duplex=False)
+
+        # workers have to share the tracker with the pool, as the blocks they create are unlinked by the pool
+        resource_tracker.ensure_running()
+        self._workers = [_PoolWorker(options) for _ in range(processes)]
+
+        self._collector = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def submit(self, contents: str) -> concurrent.futures.Future:
+        """Schedules formatting of the config. Blocks if there are too many unfinished tasks.
+        :return: future resolved with the formatted config."""
+        if self._closed:
+            raise Exception("the pool is closed")
+        self._semaphore.acquire()
+
+        input_shm = None
+        try:
+            data = contents.encode('utf-8')
+            input_size = len(data)
+            input_shm = shared_memory.SharedMemory(create=True, size=max(1, input_size))
+            input_shm.buf[:input_size] = data
+            del data
+
+            future = concurrent.futures.Future()
+            task_id = next(self._task_ids)
+            with self._lock:
+                # the pool could have been closed while waiting for the free slot
+                if self._closed:
+                    raise Exception("the pool is closed")
+                self._pending[task_id] = (future, input_shm, input_size)
+                self._waiting.append(task_id)
+                self._wakeup_sender.send_bytes(b'\0')
+        except BaseException:
+            if input_shm is not None:
+                self._release(input_shm)
+            self._semaphore.release()
+            raise
+        return future
+
+    def format_string(self, contents: str) -> str:
+        """Formats the config in one of the workers and waits for the result."""
+        return self.submit(contents).result()
+
+    def map(self, contents_iterable):
+        """Formats all configs from the iterable, yields formatted configs in the same order."""
+        futures = collections.deque()
+        for contents in contents_iterable:
+            futures.append(self.submit(contents))
+            while futures and futures[0].done():
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    def close(self, timeout: float = 5.0):
+        """Waits until all submitted tasks are finished and stops the workers. Workers which don't exit within
+        the timeout are terminated."""
+        if self._closed:
+            return
+        with self._lock:
+            self._closed = True
+            self._wakeup_sender.send_bytes(b'\0')
+        self._collector.join()
+
+        for worker in self._workers:
+            try:
+                worker.connection.send(None)
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+            worker.connection.close()
+        self._wakeup_receiver.close()
+        self._wakeup_sender.close()
+
+    def _collect_results(self):
+        while True:
+            with self._lock:
+                if self._closed and not self._pending:
+                    break
+            self._dispatch()
+
+            sentinels = {worker.process.sentinel: worker for worker in self._workers}
+            connections = {worker.connection: worker for worker in self._workers}
+            ready = multiprocessing.connection.wait([self._wakeup_receiver] + list(connections) + list(sentinels))
+
+            for ready_object in ready:
+                if ready_object is self._wakeup_receiver:
+                    while self._wakeup_receiver.poll():
+                        self._wakeup_receiver.recv_bytes()
+                elif ready_object in connections:
+                    worker = connections[ready_object]
+                    try:
+                        result = worker.connection.recv()
+                    except (EOFError, OSError):
+                        continue  # the worker is dead, its sentinel is handled below
+                    worker.task_id = None
+                    self._finish(*result)
+
+            for sentinel, worker in sentinels.items():
+                if sentinel in ready and not worker.process.is_alive():
+                    self._replace_dead_worker(worker)
+
+    def _dispatch(self):
+        """Assigns the waiting tasks to idle workers."""
+        for worker in self._workers:
+            if worker.task_id is not None or not worker.process.is_alive():
+                continue
+            with self._lock:
+                if not self._waiting:
+                    return
+                task_id = self._waiting.popleft()
+                _, input_shm, input_size = self._pending[task_id]
+            worker.task_id = task_id
+            try:
+                worker.connection.send((task_id, input_shm.name, input_size))
+            except OSError:
+                pass  # the worker is dead, the task fails when its sentinel is handled
+
+    def _finish(self, task_id: int, output_name: str, output_size: int, error: str):
+        with self._lock:
+            future, input_shm, _ = self._pending.pop(task_id, (None, None, None))
+        if future is None:
+            if output_name is not None:
+                self._release(shared_memory.SharedMemory(name=output_name))
+            return
+        self._release(input_shm)
+
+        if error is not None:
+            future.set_exception(Exception(error))
+        else:
+            output_shm = shared_memory.SharedMemory(name=output_name)
+            try:
+                future.set_result(str(output_shm.buf[:output_size], 'utf-8'))
+            finally:
+                self._release(output_shm)
+        self._semaphore.release()
+
+    def _replace_dead_worker(self, worker: _PoolWorker):
+        position = self._workers.index(worker)
+        worker.process.join()
+        worker.connection.close()
+        if worker.task_id is not None:
+            self._finish(worker.task_id, None, 0,
+                         "worker process terminated unexpectedly with exit code %s" % worker.process.exitcode)
+        self._workers[position] = _PoolWorker(self._options)
+
+    @staticmethod
+    def _release(shm):
+        shm.close()
+        shm.unlink()
+
+
+def _sandboxed_worker(options: FormatterOptions, file_path: pathlib.Path, output_path: pathlib.Path,
+                      with_index: bool, connection):
+    """Formats the file to the temporary output file and sends back the statistics and the index."""
+    try:
+        formatter = Formatter(options)
+        stats = FileStatistics(file_path)
+        index = ConfigIndex() if with_index else None
+        chosen_encoding, original_file_content = formatter._load_file_content_measured(file_path, stats)
+        with output_path.open('wb') as wfp:
+            formatter.write_formatted(original_file_content, wfp, chosen_encoding, stats, index)
+        connection.send((stats, index, None))
+    except Exception as e:
+        connection.send((None, None, str(e)))
+    finally:
+        connection.close()
+
+
+class _SandboxedTask:
+
+    def __init__(self, position: int, file_path: pathlib.Path):
+        self.position = position
+        self.file_path = file_path
+        self.output_path = None
+        self.process = None
+        self.connection = None
+        self.started = None
+
+
+class SandboxedRunner:
+    """Formats files in parallel, each one in a separate process with time limit, so a malformed or enormous file
+    can't stall the whole run. Files bigger than the limit are skipped. Formatted content is written to a temporary
+    file next to the original and only when the worker succeeds and the content differs, it's atomically renamed over
+    the original, so the original is never left half-written. Symlinks are followed, permissions and owner of the
+    original are kept. Hard links to the changed files are not preserved."""
+    _POLL_INTERVAL = 0.5
+
+    def __init__(self,
+                 options: FormatterOptions = FormatterOptions(),
+                 jobs: int = 1,
+                 timeout: float = None,
+                 max_file_size: int = None,
+                 logger: logging.Logger = None):
+        """
+        :param options: formatting options.
+        :param jobs: number of files formatted at the same time.
+        :param timeout: maximal number of seconds spent on single file.
+        :param max_file_size: files bigger than this number of bytes are skipped."""
+        self.options = options
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+        self.max_file_size = max_file_size
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def run(self,
+            file_paths: list,
+            backup_original: bool = False,
+            report: RunReport = None,
+            index: ConfigIndex = None) -> list:
+        """Formats the files in place.
+        :param file_paths: paths of the files to format.
+        :param backup_original: if set, original files are backed up as filename.conf~.
+        :param report: optional report, to which statistics of all files are added, in order of file_paths.
+        :param index: optional index, to which servers, locations and upstreams from the files are added.
+        :return: statistics of the files which were skipped or failed."""
+        waiting = collections.deque(_SandboxedTask(position, pathlib.Path(file_path))
+                                    for position, file_path in enumerate(file_paths))
+        running = []
+        results = [None] * len(waiting)
+
+        while waiting or running:
+            while waiting and len(running) < self.jobs:
+                task = waiting.popleft()
+                error = self._start(task, index is not None)
+                if error is not None:
+                    results[task.position] = (self._failed(task, error), None)
+                else:
+                    running.append(task)
+
+            if running:
+                multiprocessing.connection.wait([task.connection for task in running], self._wait_time(running))
+
+            for task in list(running):
+                result = self._poll(task, backup_original)
+                if result is not None:
+                    running.remove(task)
+                    results[task.position] = result
+
+        failed = []
+        for stats, file_index in results:
+            if report is not None:
+                report.add(stats)
+            if stats.error is not None:
+                failed.append(stats)
+            elif index is not None:
+                index.update(file_index)
+        return failed
+
+    def _start(self, task: _SandboxedTask, with_index: bool) -> str:
+        try:
+            file_size = task.file_path.stat().st_size
+        except OSError as e:
+            return str(e)
+        if self.max_file_size is not None and file_size > self.max_file_size:
+            return "file has %d bytes, limit is %d" % (file_size, self.max_file_size)
+
+        # temporary file has to be in the same directory as the original, so it can be renamed over it atomically
+        target_path = task.file_path.resolve()
+        try:
+            fd, output_path = tempfile.mkstemp(prefix='.' + target_path.name + '.', suffix='.tmp',
+                                               dir=str(target_path.parent))
+        except OSError as e:
+            return str(e)
+        os.close(fd)
+        task.output_path = pathlib.Path(output_path)
+        task.connection, child_connection = multiprocessing.Pipe(duplex=False)
+        task.process = multiprocessing.Process(target=_sandboxed_worker,
+                                               args=(self.options, task.file_path, task.output_path, with_index,
+                                                     child_connection),
+                                               daemon=True)
+        task.process.start()
+        child_connection.close()
+        task.started = time.monotonic()
+        return None
+
+    def _wait_time(self, running: list) -> float:
+        if self.timeout is None:
+            return self._POLL_INTERVAL
+        deadline = min(task.started for task in running) + self.timeout
+        return max(0.0, min(self._POLL_INTERVAL, deadline - time.monotonic()))
+
+    def _poll(self, task: _SandboxedTask, backup_original: bool):
+        """Returns (statistics, index) tuple if the task is finished, None otherwise."""
+        if task.connection.poll():
+            try:
+                stats, file_index, error = task.connection.recv()
+            except EOFError:
+                stats, file_index, error = None, None, "worker process terminated unexpectedly"
+            self._stop(task)
+            if error is not None:
+                return self._failed(task, error), None
+            try:
+                self._replace_original(task, stats, backup_original)
+            except OSError as e:
+                return self._failed(task, str(e)), None
+            return stats, file_index
+        elif not task.process.is_alive():
+            self._stop(task)
+            return self._failed(task, "worker process terminated with exit code %s" % task.process.exitcode), None
+        elif self.timeout is not None and time.monotonic() - task.started > self.timeout:
+            task.process.terminate()
+            self._stop(task)
+            return self._failed(task, "formatting took more than %s seconds" % self.timeout), None
+        return None
+
+    def _replace_original(self, task: _SandboxedTask, stats: FileStatistics, backup_original: bool):
+        if backup_original:
+            shutil.copyfile(str(task.file_path), str(task.file_path) + '~')
+            self.logger.info("Original content saved to '%s~'.", task.file_path)
+        if not stats.changed:
+            # leaves the original untouched, with its inode, owner and hard links
+            task.output_path.unlink()
+            self.logger.info("File '%s' is already formatted.", task.file_path)
+            return
+
+        target_path = task.file_path.resolve()
+        original_stat = target_path.stat()
+        shutil.copymode(str(target_path), str(task.output_path))
+        if hasattr(os, 'chown'):
+            try:
+                os.chown(str(task.output_path), original_stat.st_uid, original_stat.st_gid)
+            except PermissionError:
+                pass  # only the superuser can give the file away, the file is owned by the current user then
+        os.replace(str(task.output_path), str(target_path))
+        self.logger.info("Formatted content written to '%s'.", task.file_path)
+
+    @staticmethod
+    def _stop(task: _SandboxedTask):
+        task.process.join()
+        task.connection.close()
+
+    def _failed(self, task: _SandboxedTask, error: str) -> FileStatistics:
+        if task.output_path is not None and task.output_path.exists():
+            task.output_path.unlink()
+        self.logger.error("Skipped '%s': %s", task.file_path, error)
+        stats = FileStatistics(task.file_path)
+        stats.error = error
+        return stats
+
+
+def _file_signature(file_path: pathlib.Path) -> tuple:
+    """Returns modification time and size of the file, used to detect whether it was changed."""
+    stat = file_path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+class _PollingWatchBackend:
+    """Detects changed files by periodic scanning of the directory tree. Used when inotify is not available."""
+
+    def __init__(self, directory: pathlib.Path, interval: float = 0.5):
+        """
+        :param interval: maximal time between the scans. Changes are timestamped after the scan, so it limits
+        the delay of formatting."""
+        self.directory = directory
+        self.interval = interval
+        self._signatures = self._scan()
+
+    def _scan(self) -> dict:
+        signatures = {}
+        for dir_path, _, file_names in os.walk(str(self.directory)):
+            for file_name in file_names:
+                file_path = pathlib.Path(dir_path, file_name)
+                try:
+                    signatures[file_path] = _file_signature(file_path)
+                except OSError:
+                    pass
+        return signatures
+
+    def read_events(self, timeout: float) -> set:
+        """Waits given number of seconds, but no longer than the scan interval, and returns paths of files created or
+        modified in the meantime."""
+        if timeout > 0:
+            time.sleep(min(timeout, self.interval))
+        signatures = self._scan()
+        changed = {path for path, signature in signatures.items() if self._signatures.get(path) != signature}
+        self._signatures = signatures
+        return changed
+
+    def close(self):
+        pass
+
+
+class _InotifyWatchBackend:
+    """Detects changed files using Linux inotify API, accessed through ctypes to avoid additional dependencies."""
+    _IN_MODIFY = 0x00000002
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_Q_OVERFLOW = 0x00004000
+    _IN_ISDIR = 0x40000000
+    _IN_CLOEXEC = 0o2000000
+
+    _WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+    _EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directory: pathlib.Path, logger: logging.Logger = None):
+        self.directory = directory
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(self._IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._watched_dirs = {}
+        self._add_watch_recursively(directory)
+
+    def _add_watch_recursively(self, directory: pathlib.Path, ignore_errors: bool = False) -> set:
+        """Watches the directory and all its subdirectories.
+        :param ignore_errors: if set, directories which can't be watched are logged and skipped instead of raising.
+        :return: paths of files already present in the newly watched directories."""
+        files = set()
+        for dir_path, dir_names, file_names in os.walk(str(directory)):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), self._WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if not ignore_errors:
+                    raise OSError(err, os.strerror(err), dir_path)
+                self.logger.warning("Cannot watch '%s': %s.", dir_path, os.strerror(err))
+                dir_names.clear()
+                continue
+            self._watched_dirs[wd] = pathlib.Path(dir_path)
+            files.update(pathlib.Path(dir_path, file_name) for file_name in file_names)
+        return files
+
+    def read_events(self, timeout: float) -> set:
+        """Waits at most given number of seconds for the events and returns paths of created or modified files."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        data = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = self._EVENT_HEADER.unpack_from(data, offset)
+            offset += self._EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+
+            if mask & self._IN_Q_OVERFLOW:
+                # events were lost, so every file has to be considered modified
+                changed.update(pathlib.Path(dir_path, file_name)
+                               for dir_path, _, file_names in os.walk(str(self.directory))
+                               for file_name in file_names)
+                continue
+
+            if wd not in self._watched_dirs or not name:
+                continue
+            path = self._watched_dirs[wd] / os.fsdecode(name)
+
+            if mask & self._IN_ISDIR:
+                if mask & (self._IN_CREATE | self._IN_MOVED_TO):
+                    # files written before the watch was added don't generate events
+                    changed.update(self._add_watch_recursively(path, ignore_errors=True))
+            else:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class Watcher:
+    """Watches the directory tree and formats config files as soon as they are modified. Bursts of changes are
+    debounced, so each file is formatted once the editor has finished writing it. Files written by the watcher itself
+    are not formatted again."""
+    _IDLE_TIMEOUT = 1.0
+
+    def __init__(self,
+                 formatter: Formatter,
+                 directory: pathlib.Path,
+                 pattern: str = '*.conf',
+                 debounce: float = 0.5,
+                 backend=None):
+        """
+        :param formatter: formatter instance, reused for all the files.
+        :param directory: root of the watched directory tree.
+        :param pattern: shell-style pattern, only matching file names are formatted.
+        :param debounce: number of seconds the file has to stay unmodified before it is formatted.
+        :param backend: optional source of file system events. inotify is used if available, polling otherwise."""
+        self.formatter = formatter
+        self.directory = directory
+        self.pattern = pattern
+        self.debounce = debounce
+        self._backend = backend if backend is not None else self._create_backend(directory)
+        self._pending = {}
+        self._own_writes = {}
+
+    def _create_backend(self, directory: pathlib.Path):
+        try:
+            return _InotifyWatchBackend(directory, self.formatter.logger)
+        except (OSError, AttributeError, TypeError) as e:
+            self.formatter.logger.info("inotify not available (%s), falling back to polling.", e)
+            return _PollingWatchBackend(directory, self.debounce if self.debounce > 0 else 0.5)
+
+    def run(self):
+        """Formats the modified files until interrupted."""
+        self.formatter.logger.info("Watching '%s' for changes in files matching '%s'.", self.directory, self.pattern)
+        try:
+            while True:
+                self.run_once()
+        finally:
+            self.close()
+
+    def run_once(self, timeout: float = None) -> list:
+        """Collects the file system events, then formats the files which were not modified for at least debounce
+        interval.
+        :param timeout: maximal time of waiting for the events. By default, it's the time when the first pending
+        file becomes ready for formatting.
+        :return: list of files which were changed by formatting."""
+        if timeout is None:
+            timeout = self._IDLE_TIMEOUT
+            if self._pending:
+                timeout = max(0.0, min(self._pending.values()) + self.debounce - time.monotonic())
+
+        # the events are timestamped when the waiting ends, as they might have arrived at any moment of it
+        events = self._backend.read_events(timeout)
+        now = time.monotonic()
+        for path in events:
+            if fnmatch.fnmatch(path.name, self.pattern):
+                self._pending[path] = now
+
+        formatted = []
+        for path, changed_at in list(self._pending.items()):
+            if now - changed_at >= self.debounce:
+                del self._pending[path]
+                if self._format(path):
+                    formatted.append(path)
+        return formatted
+
+    def _format(self, file_path: pathlib.Path) -> bool:
+        try:
+            if self._own_writes.get(file_path) == _file_signature(file_path):
+                return False
+
+            stats = FileStatistics(file_path)
+            chosen_encoding, original_file_content = self.formatter._load_file_content(file_path)
+            output = io.BytesIO()
+            self.formatter.write_formatted(original_file_content, output, chosen_encoding, stats)
+            if stats.changed:
+                with file_path.open('wb') as wfp:
+                    wfp.write(output.getvalue())
+                self.formatter.logger.info("Formatted content written to '%s'.", file_path)
+
+            self._own_writes[file_path] = _file_signature(file_path)
+            return stats.changed
+        except FileNotFoundError:
+            self._own_writes.pop(file_path, None)
+            return False
+        except Exception as e:
+            self.formatter.logger.error("Cannot format '%s': %s", file_path, e)
+            return False
+
+    def close(self):
+        self._backend.close()
+
+
 @contextlib.contextmanager
 def _redirect_stdout_to_stderr():
     """Redirects stdout to stderr for argument parsing. This is to don't pollute the stdout
@@ -327,6 +1289,66 @@ def _redirect_stdout_to_stderr():
         sys.stdout = old_stdout
 
 
+def _write_formatted_to_stdout(formatter: Formatter, contents: str, stats: FileStatistics, index: ConfigIndex):
+    """Streams formatted config to stdout, directly to underlying binary buffer if possible."""
+    sys.stdout.flush()
+    if hasattr(sys.stdout, 'buffer'):
+        formatter.write_formatted(contents, sys.stdout.buffer, sys.stdout.encoding, stats, index)
+        sys.stdout.buffer.flush()
+    else:
+        formatter.write_formatted(contents, sys.stdout, stats=stats, index=index)
+
+
+def _serve_framed(formatter: Formatter, input_stream, output_stream, default_file_name: str,
+                  report: RunReport = None):
+    """Formats successive documents read from the binary input stream, so editors can keep single process running.
+
+    Each request is a header line with the length of the document in bytes, optionally followed by space and the file
+    name, then the UTF-8 encoded document. Each response is a header line 'ok <length>' followed by the formatted
+    document or 'error <length>' followed by the error message. Processing ends at the end of input or at malformed
+    header.
+    :param report: optional report, to which statistics of every document are added. It's never cleared, so it should
+    be passed only if it's going to be printed."""
+    while True:
+        header = input_stream.readline()
+        if not header:
+            break
+        length_field, _, file_name = header.rstrip(b'\r\n').partition(b' ')
+        if not re.fullmatch(rb'[0-9]+', length_field):
+            _write_frame(output_stream, 'error', "malformed header: %r" % header)
+            break
+        length = int(length_field)
+
+        stats = FileStatistics(file_name.decode('utf-8', 'replace') or default_file_name)
+        stats.encoding = 'utf-8'
+        started = time.perf_counter()
+        data = input_stream.read(length)
+        stats.read_time = time.perf_counter() - started
+        stats.bytes_in = len(data)
+        try:
+            if len(data) != length:
+                raise Exception("unexpected end of input, expected %d bytes, got %d" % (length, len(data)))
+            output = io.BytesIO()
+            formatter.write_formatted(data.decode('utf-8'), output, 'utf-8', stats)
+            _write_frame(output_stream, 'ok', output.getvalue())
+        except Exception as e:
+            formatter.logger.error("Cannot format '%s': %s", stats.file_path, e)
+            stats.error = str(e)
+            _write_frame(output_stream, 'error', stats.error)
+        if report is not None:
+            report.add(stats)
+        if stats.error is not None and len(data) != length:
+            break
+
+
+def _write_frame(output_stream, status: str, payload):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    output_stream.write(('%s %d\n' % (status, len(payload))).encode('ascii'))
+    output_stream.write(payload)
+    output_stream.flush()
+
+
 def _aname(action) -> str:
     """Converts argument name to string to be consistent with argparse."""
     if action.option_strings:
@@ -342,6 +1364,15 @@ def _standalone_run(program_arguments):
     pipe_arg = arg_parser.add_argument("-", "--pipe",
                                        action="store_true",
                                        help="reads content from standard input, prints result to stdout")
+    arg_parser.add_argument("--stdin-filename",
+                            metavar="PATH",
+                            help="name of the file piped to standard input, used in logs and reports; implies %s"
+                                 % _aname(pipe_arg))
+    framed_arg = arg_parser.add_argument("--framed",
+                                         action="store_true",
+                                         help="reads successive length-prefixed documents from standard input and "
+                                              "writes length-prefixed results, until end of input; implies %s"
+                                              % _aname(pipe_arg))
 
     pipe_xor_backup_group = arg_parser.add_mutually_exclusive_group()
     print_result_arg = pipe_xor_backup_group.add_argument("-p", "--print-result",
@@ -362,6 +1393,12 @@ def _standalone_run(program_arguments):
                                          default=4,
                                          type=int,
                                          help="specify number of spaces for indentation")
+    formatter_options_group.add_argument("--buffer-size",
+                                         type=int,
+                                         default=FormatterOptions.write_buffer_size,
+                                         metavar="CHARS",
+                                         help="formatted output is written in chunks of this size "
+                                              "(default: %(default)s)")
     formatter_options_group.add_argument(
         "--line-endings",
         choices=["auto", "unix", "windows", "crlf", "lf"],
@@ -372,6 +1409,48 @@ def _standalone_run(program_arguments):
         )
     )
 
+    report_group = arg_parser.add_argument_group("reporting")
+    report_group.add_argument("--report",
+                              choices=["json"],
+                              help="prints summary of processed files with sizes and timings to stderr")
+    index_report_arg = report_group.add_argument("--index-report",
+                                                 action="store_true",
+                                                 help="prints duplicated server names, locations and upstreams found "
+                                                      "in all files to stderr")
+    report_group.add_argument("--prometheus-textfile",
+                              metavar="PATH",
+                              help="writes run metrics to file in Prometheus textfile collector format")
+
+    sandbox_group = arg_parser.add_argument_group("parallel formatting",
+                                                  "if any of these is given, each file is formatted in a separate "
+                                                  "process, the original is replaced only when formatting succeeds")
+    jobs_arg = sandbox_group.add_argument("-j", "--jobs",
+                                          type=int,
+                                          help="number of files formatted in parallel (default: 1)")
+    timeout_arg = sandbox_group.add_argument("--timeout",
+                                             type=float,
+                                             metavar="SECONDS",
+                                             help="files taking longer to format are skipped")
+    max_file_size_arg = sandbox_group.add_argument("--max-file-size",
+                                                   type=int,
+                                                   metavar="BYTES",
+                                                   help="bigger files are skipped")
+
+    watch_group = arg_parser.add_argument_group("watch mode")
+    watch_arg = watch_group.add_argument("--watch",
+                                         metavar="DIR",
+                                         help="formats config files in the directory tree whenever they are modified")
+    watch_group.add_argument("--watch-pattern",
+                             default="*.conf",
+                             metavar="PATTERN",
+                             help="only files matching this pattern are formatted in watch mode (default: %(default)s)")
+    watch_group.add_argument("--debounce",
+                             type=float,
+                             default=0.5,
+                             metavar="SECONDS",
+                             help="time the file has to stay unmodified before it is formatted "
+                                  "(default: %(default)s)")
+
     with _redirect_stdout_to_stderr():
         args = arg_parser.parse_args(program_arguments)
 
@@ -379,6 +1458,8 @@ def _standalone_run(program_arguments):
         level=logging.INFO if args.verbose else logging.ERROR,
         format='%(levelname)s: %(message)s')
 
+    args.pipe = args.pipe or args.stdin_filename is not None or args.framed
+
     try:
         if args.pipe and len(args.config_files) != 0:
             raise Exception("if %s is enabled, no file can be passed as input" % _aname(pipe_arg))
@@ -386,13 +1467,25 @@ def _standalone_run(program_arguments):
             raise Exception("cannot create backup file when %s is enabled" % _aname(pipe_arg))
         if args.print_result and len(args.config_files) > 1:
             raise Exception("if %s is enabled, only one file can be passed as input" % _aname(print_result_arg))
-        if len(args.config_files) == 0 and not args.pipe:
+        if args.watch and (args.pipe or args.print_result or args.backup_original or len(args.config_files) != 0):
+            raise Exception("if %s is enabled, no other input or output can be specified" % _aname(watch_arg))
+        sandboxed = args.jobs is not None or args.timeout is not None or args.max_file_size is not None
+        if sandboxed and (args.pipe or args.print_result or args.watch):
+            raise Exception("%s, %s and %s can be used only when formatting files in place"
+                            % (_aname(jobs_arg), _aname(timeout_arg), _aname(max_file_size_arg)))
+        if args.framed and args.index_report:
+            # the same document is usually sent many times, so it would be reported as duplicate of itself
+            raise Exception("%s cannot be used with %s" % (_aname(index_report_arg), _aname(framed_arg)))
+        if args.watch and not os.path.isdir(args.watch):
+            raise Exception("'%s' passed to %s is not a directory" % (args.watch, _aname(watch_arg)))
+        if len(args.config_files) == 0 and not args.pipe and not args.watch:
             raise Exception("no input files provided, specify at least one file or use %s" % _aname(pipe_arg))
     except Exception as e:
         arg_parser.error(str(e))
 
     format_options = FormatterOptions()
     format_options.indentation = args.indent
+    format_options.write_buffer_size = args.buffer_size
 
     if args.line_endings in ["unix", "lf"]:
         format_options.line_endings = '\n'
@@ -402,16 +1495,56 @@ def _standalone_run(program_arguments):
         format_options.line_endings = os.linesep
 
     formatter = Formatter(format_options)
-
-    if args.pipe:
-        original_content = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
-        print(formatter.format_string(original_content.read()), end="")
+    report = RunReport()
+    index = ConfigIndex() if args.index_report else None
+    failed = []
+
+    if args.watch:
+        watcher = Watcher(formatter, pathlib.Path(args.watch), args.watch_pattern, args.debounce)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+    elif args.framed:
+        sys.stdout.flush()
+        # statistics of every request are kept, so they're collected only if they are reported
+        reported = args.report is not None or args.prometheus_textfile is not None
+        _serve_framed(formatter, sys.stdin.buffer, sys.stdout.buffer, args.stdin_filename or '<stdin>',
+                      report if reported else None)
+    elif args.pipe:
+        stats = FileStatistics(args.stdin_filename or '<stdin>')
+        stats.encoding = 'utf-8'
+        started = time.perf_counter()
+        data = sys.stdin.buffer.read()
+        stats.read_time = time.perf_counter() - started
+        stats.bytes_in = len(data)
+        original_content = data.decode(stats.encoding)
+        del data
+        _write_formatted_to_stdout(formatter, original_content, stats, index)
+        report.add(stats)
     elif args.print_result:
-        print(formatter.get_formatted_string_from_file(pathlib.Path(args.config_files[0])), end="")
+        stats = FileStatistics(args.config_files[0])
+        _, original_content = formatter._load_file_content_measured(pathlib.Path(args.config_files[0]), stats)
+        _write_formatted_to_stdout(formatter, original_content, stats, index)
+        report.add(stats)
+    elif sandboxed:
+        runner = SandboxedRunner(format_options, args.jobs or 1, args.timeout, args.max_file_size)
+        failed = runner.run(args.config_files, args.backup_original, report, index)
     else:
         for config_file_path in args.config_files:
             backup_file_path = pathlib.Path(config_file_path + '~') if args.backup_original else None
-            formatter.format_file(pathlib.Path(config_file_path), backup_file_path)
+            stats = FileStatistics(config_file_path)
+            formatter.format_file(pathlib.Path(config_file_path), backup_file_path, stats, index)
+            report.add(stats)
+
+    if args.report == "json":
+        print(report.to_json(), file=sys.stderr)
+    if args.prometheus_textfile:
+        report.write_prometheus_textfile(pathlib.Path(args.prometheus_textfile))
+    if index is not None:
+        print(index.report(), file=sys.stderr)
+    if failed:
+        sys.exit(1)
 
 
 def main():
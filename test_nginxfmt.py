@@ -4,12 +4,20 @@
 """Unit tests for nginxfmt module."""
 import contextlib
 import io
+import json
 import logging
+import os
 import pathlib
 import shutil
+import signal
+import sys
 import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
 
+import fuzz_nginxfmt
 import nginxfmt
 
 __author__ = "Michał Słomkowski"
@@ -277,6 +285,93 @@ class TestFormatter(unittest.TestCase):
         finally:
             tmp_file.unlink()
 
+    def test_crlf_empty_lines_removal(self):
+        self.check_formatting(
+            "\r\n\r\nfoo bar {\r\n\r\n\r\n\r\n\r\n    lorem ipsum;\r\n}\r\n\r\n",
+            "\r\nfoo bar {\r\n\r\n\r\n    lorem ipsum;\r\n}\r\n",
+            formatter=self.fmt_crlf)
+
+    def test_write_formatted(self):
+        fo = nginxfmt.FormatterOptions()
+        fo.line_endings = '\n'
+        fo.write_buffer_size = 16
+        fmt = nginxfmt.Formatter(fo)
+        original = fuzz_nginxfmt.make_minified_config(2000) + "\n# Statusseite für Monitoring\n"
+
+        stream = io.BytesIO()
+        stats = nginxfmt.FileStatistics('<test>')
+        fmt.write_formatted(original, stream, 'latin1', stats)
+        self.assertEqual(self.fmt.format_string(original).encode('latin1'), stream.getvalue())
+        self.assertEqual(len(stream.getvalue()), stats.bytes_out)
+        self.assertTrue(stats.changed)
+
+        formatted = self.fmt.format_string(original)
+        stream = io.StringIO()
+        fmt.write_formatted(formatted, stream, stats=stats)
+        self.assertEqual(formatted, stream.getvalue())
+        self.assertFalse(stats.changed)
+
+        stream = io.StringIO()
+        fmt.write_formatted(formatted + "extra;", stream, stats=stats)
+        self.assertTrue(stats.changed)
+
+    def test_crlf_file_statistics(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file = pathlib.Path(tmp_dir, 'crlf.conf')
+            config_file.write_bytes(b"server {\r\n    listen 80;\r\n}\r\n")
+
+            stats = nginxfmt.FileStatistics(config_file)
+            self.fmt_crlf.format_file(config_file, stats=stats)
+            self.assertEqual(b"server {\r\n    listen 80;\r\n}\r\n", config_file.read_bytes())
+            self.assertFalse(stats.changed)
+            self.assertEqual(3, stats.lines_in)
+
+            stats = nginxfmt.FileStatistics(config_file)
+            self.assertEqual("server {\r\n    listen 80;\r\n}\r\n",
+                             self.fmt_crlf.get_formatted_string_from_file(config_file, stats))
+            self.assertFalse(stats.changed)
+
+            stats = nginxfmt.FileStatistics(config_file)
+            self.fmt.format_file(config_file, stats=stats)
+            self.assertEqual(b"server {\n    listen 80;\n}\n", config_file.read_bytes())
+            self.assertTrue(stats.changed)
+
+    def test_config_index(self):
+        index = nginxfmt.ConfigIndex()
+        for file_path, contents in (
+                ('a.conf', "upstream app { server 10.0.0.1; }\n"
+                           "server { listen 80; server_name a.com b.com;\n"
+                           "location / { location /x {} location /y {} } location /x {} location / {} }\n"),
+                ('b.conf', "upstream app { server 10.0.0.2; }\n"
+                           "server { server_name a.com; listen 443 ssl; }\n"
+                           "server { server_name b.com; }\n"),
+                ('c.conf', "server {\n"
+                           "listen 443; # main listener\n"
+                           "server_name a.com \"c;#.com\"; # main site\n"
+                           "}\n")):
+            self.fmt.write_formatted(contents, io.StringIO(), stats=nginxfmt.FileStatistics(file_path), index=index)
+
+        self.assertEqual([('a.com', '*:443', ['b.conf:4', 'c.conf:1']),
+                          ('b.com', '*:80', ['a.conf:4', 'b.conf:8'])], index.duplicate_server_names())
+        self.assertEqual([('/', ['a.conf:7', 'a.conf:16'])], index.duplicate_locations)
+        self.assertEqual([('app', ['a.conf:1', 'b.conf:1'])], index.duplicate_upstreams())
+        self.assertEqual(['a.conf:4', 'b.conf:4', 'c.conf:1'], index.server_names['a.com'])
+        self.assertEqual(['c.conf:1'], index.server_names['"c;#.com"'])
+        self.assertEqual(['b.conf:4', 'c.conf:1'], index.listen['*:443'])
+
+    def test_format_file_statistics(self):
+        tmp_file = pathlib.Path(tempfile.mkstemp('latin1')[1])
+        try:
+            shutil.copy('test-files/umlaut-latin1.conf', tmp_file)
+            stats = nginxfmt.FileStatistics(tmp_file)
+            self.fmt.format_file(tmp_file, stats=stats)
+            self.assertEqual('latin1', stats.encoding)
+            self.assertEqual(pathlib.Path('test-files/umlaut-latin1.conf').stat().st_size, stats.bytes_in)
+            self.assertEqual(tmp_file.stat().st_size, stats.bytes_out)
+            self.assertEqual(tmp_file.read_text('latin1').count('\n'), stats.lines_out)
+        finally:
+            tmp_file.unlink()
+
     def test_issue_15(self):
         self.check_formatting(
             'section { server_name "~^(?<tag>[0-9a-f]{8}\-[0-9a-f]{4}\-[0-9a-f]{4}\-[0-9a-f]{4}\-[0-9a-f]{12})\.a\.b\.com$"; }',
@@ -440,6 +535,462 @@ class TestStandaloneRun(unittest.TestCase):
         self.assertEqual(output.count('\r\n'), 0)
         self.assertEqual(output.count('\n'), 5)
 
+    def test_stdin_filename(self):
+        stdin = io.TextIOWrapper(io.BytesIO("a {\nb ü;\n}\n".encode('utf-8')))
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with unittest.mock.patch('sys.stdin', stdin), contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(stderr):
+            nginxfmt._standalone_run(['--line-endings=unix', '--stdin-filename=sites/a.conf', '--report=json'])
+        self.assertEqual("a {\n    b ü;\n}\n", stdout.getvalue())
+        report = json.loads(stderr.getvalue())
+        self.assertEqual('sites/a.conf', report['files'][0]['file_path'])
+        self.assertEqual(12, report['files'][0]['bytes_in'])
+
+    def test_framed(self):
+        fmt_options = nginxfmt.FormatterOptions()
+        fmt_options.line_endings = '\n'
+        input_stream = io.BytesIO(b'8 a.conf\na {\nb;}\n'
+                                  b'6\nx;\xc3\xbc;\n'
+                                  b'2 b.conf\n\xff;'
+                                  b'9 c.conf\nserver {')
+        output_stream = io.BytesIO()
+        report = nginxfmt.RunReport()
+
+        nginxfmt._serve_framed(nginxfmt.Formatter(fmt_options), input_stream, output_stream, '<stdin>', report)
+
+        output = io.BytesIO(output_stream.getvalue())
+        self.assertEqual(b'ok 13\n', output.readline())
+        self.assertEqual(b'a {\n    b;\n}\n', output.read(13))
+        self.assertEqual(b'ok 7\n', output.readline())
+        self.assertEqual('x;\nü;\n'.encode('utf-8'), output.read(7))
+        status, length = output.readline().split()
+        self.assertEqual(b'error', status)
+        self.assertIn(b"can't decode", output.read(int(length)))
+        status, length = output.readline().split()
+        self.assertEqual(b'error', status)
+        self.assertIn(b"unexpected end of input", output.read(int(length)))
+        self.assertEqual(b'', output.read())
+        self.assertEqual(['a.conf', '<stdin>', 'b.conf', 'c.conf'], [f.file_path for f in report.files])
+        self.assertEqual([None, None], [f.error for f in report.files[:2]])
+
+    def test_framed_without_report(self):
+        output_stream = io.BytesIO()
+        with unittest.mock.patch.object(nginxfmt.RunReport, 'add') as add:
+            nginxfmt._serve_framed(nginxfmt.Formatter(), io.BytesIO(b'4\na;b;4\na;b;'), output_stream, '<stdin>')
+        add.assert_not_called()
+        self.assertEqual(2, output_stream.getvalue().count(b'ok '))
+
+    def test_framed_index_report(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit) as cm:
+                nginxfmt._standalone_run(['--framed', '--index-report'])
+        self.assertEqual(2, cm.exception.code)
+
+    def test_report_crlf_unchanged(self):
+        f = io.StringIO()
+        with self.input_test_file('not-formatted-1.conf') as input_file:
+            formatted = nginxfmt.Formatter().format_string(pathlib.Path(input_file).read_text())
+            pathlib.Path(input_file).write_bytes(formatted.replace('\n', '\r\n').encode('utf-8'))
+            with contextlib.redirect_stderr(f):
+                nginxfmt._standalone_run(['--line-endings=crlf', '--report=json', input_file])
+        report = json.loads(f.getvalue())
+        self.assertEqual(0, report['totals']['files_changed'])
+        self.assertFalse(report['files'][0]['changed'])
+
+    def test_framed_malformed_header(self):
+        for header in ('²\n'.encode('utf-8'), b'-1\n', b'x.conf 5\n'):
+            output_stream = io.BytesIO()
+            nginxfmt._serve_framed(nginxfmt.Formatter(), io.BytesIO(header + b'a;b;\n'), output_stream, '<stdin>')
+            status, length = output_stream.getvalue().split(b'\n', 1)[0].split()
+            self.assertEqual(b'error', status)
+            self.assertIn(b'malformed header', output_stream.getvalue())
+
+    def test_max_file_size(self):
+        with self.input_test_file('not-formatted-1.conf') as input_file:
+            with self.assertRaises(SystemExit) as cm:
+                nginxfmt._standalone_run(['--max-file-size=10', input_file])
+            self.assertEqual(1, cm.exception.code)
+            self.assertEqual(pathlib.Path('test-files/not-formatted-1.conf').read_text(),
+                             pathlib.Path(input_file).read_text())
+
+    def test_report_json(self):
+        f = io.StringIO()
+        with self.input_test_file('not-formatted-1.conf') as input_file:
+            with contextlib.redirect_stderr(f):
+                nginxfmt._standalone_run(['--line-endings=unix', '--report=json', input_file, input_file])
+        report = json.loads(f.getvalue())
+        self.assertEqual(2, report['totals']['files'])
+        self.assertEqual(1, report['totals']['files_changed'])
+        self.assertEqual(5, report['files'][1]['lines_out'])
+        self.assertEqual('utf-8', report['files'][0]['encoding'])
+
+
+@unittest.skipIf(nginxfmt.shared_memory is None, "multiprocessing.shared_memory is not available")
+class TestFormatterPool(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.fmt_options = nginxfmt.FormatterOptions()
+        self.fmt_options.line_endings = '\n'
+        self.fmt = nginxfmt.Formatter(self.fmt_options)
+
+    def test_map(self):
+        configs = [fuzz_nginxfmt.ConfigGenerator(seed).generate() for seed in range(50)]
+        configs.append(fuzz_nginxfmt.make_minified_config(100000))
+        configs.append("")
+        with nginxfmt.FormatterPool(self.fmt_options, processes=2, max_pending=3) as pool:
+            self.assertEqual([self.fmt.format_string(c) for c in configs], list(pool.map(configs)))
+
+    def test_format_string(self):
+        with nginxfmt.FormatterPool(self.fmt_options, processes=1) as pool:
+            self.assertEqual("a {\n    b ${var} \"ü\";\n}\n", pool.format_string("a { b ${ var } \"ü\"; }"))
+
+    def test_killed_idle_worker(self):
+        pool = nginxfmt.FormatterPool(self.fmt_options, processes=2)
+        killed = pool._workers[0].process
+        os.kill(killed.pid, signal.SIGKILL)
+        killed.join()
+
+        configs = [fuzz_nginxfmt.make_minified_config(100000)] + ["a;b;"] * 10
+        self.assertEqual([self.fmt.format_string(c) for c in configs], list(pool.map(configs)))
+        started = time.monotonic()
+        pool.close()
+        self.assertLess(time.monotonic() - started, 5.0)
+        self.assertNotIn(killed, [worker.process for worker in pool._workers])
+
+    def test_killed_busy_worker(self):
+        with nginxfmt.FormatterPool(self.fmt_options, processes=2) as pool:
+            busy = pool.submit(fuzz_nginxfmt.make_minified_config(5000000))
+            while all(worker.task_id is None for worker in pool._workers):
+                time.sleep(0.01)
+            busy_worker = next(worker for worker in pool._workers if worker.task_id is not None)
+            os.kill(busy_worker.process.pid, signal.SIGKILL)
+
+            self.assertRaisesRegex(Exception, 'terminated unexpectedly', busy.result)
+            self.assertEqual("a;\nb;\n", pool.format_string("a;b;"))
+
+    def test_closed(self):
+        pool = nginxfmt.FormatterPool(self.fmt_options, processes=1)
+        future = pool.submit("a;b;")
+        pool.close()
+        self.assertEqual("a;\nb;\n", future.result())
+        self.assertRaises(Exception, pool.submit, "a;")
+        pool.close()
+
+    def test_closed_while_submit_blocked(self):
+        pool = nginxfmt.FormatterPool(self.fmt_options, processes=1, max_pending=1)
+        busy = pool.submit(fuzz_nginxfmt.make_minified_config(5000000))
+
+        blocked = threading.Event()
+        original_acquire = pool._semaphore.acquire
+
+        def acquire(*args, **kwargs):
+            blocked.set()
+            return original_acquire(*args, **kwargs)
+
+        pool._semaphore.acquire = acquire
+        errors = []
+
+        def submit():
+            try:
+                pool.submit("a;b;")
+            except Exception as e:
+                errors.append(str(e))
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        blocked.wait()
+        pool.close()
+        thread.join(5.0)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(["the pool is closed"], errors)
+        self.assertTrue(busy.result().startswith("http {\n"))
+        self.assertEqual({}, pool._pending)
+        # the slot taken by the rejected task is given back
+        self.assertTrue(original_acquire(blocking=False))
+
+    def test_submit_failure_releases_slot(self):
+        with nginxfmt.FormatterPool(self.fmt_options, processes=1, max_pending=1) as pool:
+            with unittest.mock.patch.object(nginxfmt.shared_memory, 'SharedMemory', side_effect=OSError("no space")):
+                self.assertRaises(OSError, pool.submit, "a;")
+            self.assertEqual("a;\nb;\n", pool.format_string("a;b;"))
+
+
+class TestSandboxedRunner(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+        self.fmt_options = nginxfmt.FormatterOptions()
+        self.fmt_options.line_endings = '\n'
+
+    def tearDown(self) -> None:
+        shutil.rmtree(str(self.tmp_dir))
+
+    def create_file(self, name, contents):
+        file_path = self.tmp_dir / name
+        file_path.write_text(contents)
+        return file_path
+
+    def test_parallel(self):
+        files = [self.create_file('%d.conf' % i, "server { server_name example.com; }") for i in range(5)]
+        files.append(self.tmp_dir / 'missing.conf')
+        report = nginxfmt.RunReport()
+        index = nginxfmt.ConfigIndex()
+
+        failed = nginxfmt.SandboxedRunner(self.fmt_options, jobs=3).run(files, True, report, index)
+
+        self.assertEqual([str(files[-1])], [f.file_path for f in failed])
+        self.assertEqual([str(f) for f in files], [f.file_path for f in report.files])
+        for file_path in files[:-1]:
+            self.assertEqual("server {\n    server_name example.com;\n}\n", file_path.read_text())
+            self.assertEqual("server { server_name example.com; }", pathlib.Path(str(file_path) + '~').read_text())
+        self.assertEqual(5, len(index.server_names['example.com']))
+
+    def test_replace_failure(self):
+        broken_file = self.create_file('broken.conf', "a;b;")
+        other_file = self.create_file('other.conf', "a;b;")
+        link_file = self.tmp_dir / 'link.conf'
+        link_file.symlink_to(other_file)
+        runner = nginxfmt.SandboxedRunner(self.fmt_options, jobs=2)
+
+        # the worker succeeds, but the formatted file can't be renamed over the original
+        original_replace = os.replace
+
+        def failing_replace(source, destination):
+            if destination == str(broken_file.resolve()):
+                raise PermissionError("read-only file system")
+            return original_replace(source, destination)
+
+        with unittest.mock.patch('os.replace', failing_replace):
+            failed = runner.run([broken_file, link_file])
+
+        self.assertEqual([str(broken_file)], [f.file_path for f in failed])
+        self.assertIn('read-only file system', failed[0].error)
+        self.assertEqual("a;b;", broken_file.read_text())
+        self.assertTrue(link_file.is_symlink())
+        self.assertEqual("a;\nb;\n", other_file.read_text())
+        self.assertEqual([], list(self.tmp_dir.glob('.*.tmp')))
+
+    def test_temporary_file_failure(self):
+        target_dir = self.tmp_dir / 'target'
+        target_dir.mkdir()
+        target_file = self.create_file('target/a.conf', "a;b;")
+        with unittest.mock.patch('tempfile.mkstemp', side_effect=PermissionError("read-only directory")):
+            failed = nginxfmt.SandboxedRunner(self.fmt_options).run([target_file])
+        self.assertEqual([str(target_file)], [f.file_path for f in failed])
+        self.assertIn('read-only directory', failed[0].error)
+        self.assertEqual("a;b;", target_file.read_text())
+
+    def test_keeps_file_attributes(self):
+        formatted_file = self.create_file('formatted.conf', "a;\nb;\n")
+        hard_link = self.tmp_dir / 'hard-link.conf'
+        os.link(str(formatted_file), str(hard_link))
+        changed_file = self.create_file('changed.conf', "a;b;")
+        changed_file.chmod(0o640)
+        if os.geteuid() == 0:
+            os.chown(str(changed_file), 1234, 1234)
+        inode = formatted_file.stat().st_ino
+
+        failed = nginxfmt.SandboxedRunner(self.fmt_options, jobs=2).run([formatted_file, changed_file])
+
+        self.assertEqual([], failed)
+        self.assertEqual(inode, formatted_file.stat().st_ino)
+        self.assertTrue(os.path.samefile(str(formatted_file), str(hard_link)))
+        self.assertEqual("a;\nb;\n", changed_file.read_text())
+        self.assertEqual(0o640, changed_file.stat().st_mode & 0o777)
+        if os.geteuid() == 0:
+            self.assertEqual((1234, 1234), (changed_file.stat().st_uid, changed_file.stat().st_gid))
+        self.assertEqual([], list(self.tmp_dir.glob('.*.tmp')))
+
+    def test_limits(self):
+        slow_config = fuzz_nginxfmt.make_minified_config(5000000)
+        big_file = self.create_file('big.conf', fuzz_nginxfmt.make_minified_config(20000))
+        slow_file = self.create_file('slow.conf', slow_config)
+        small_file = self.create_file('small.conf', "a;b;")
+
+        failed = nginxfmt.SandboxedRunner(self.fmt_options, max_file_size=10000).run([big_file, small_file])
+        self.assertEqual([str(big_file)], [f.file_path for f in failed])
+        self.assertIn('limit is 10000', failed[0].error)
+        self.assertEqual("a;\nb;\n", small_file.read_text())
+
+        failed = nginxfmt.SandboxedRunner(self.fmt_options, jobs=2, timeout=0.2).run([slow_file, small_file])
+        self.assertEqual([str(slow_file)], [f.file_path for f in failed])
+        self.assertIn('more than 0.2 seconds', failed[0].error)
+        self.assertEqual(slow_config, slow_file.read_text())
+
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = pathlib.Path(tempfile.mkdtemp())
+        fmt_options = nginxfmt.FormatterOptions()
+        fmt_options.line_endings = '\n'
+        self.fmt = nginxfmt.Formatter(fmt_options)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(str(self.tmp_dir))
+
+    def create_watcher(self, backend_class, debounce=0.0):
+        return nginxfmt.Watcher(self.fmt, self.tmp_dir, debounce=debounce, backend=backend_class(self.tmp_dir))
+
+    def check_formats_modified_file(self, backend_class):
+        config_file = self.tmp_dir / 'site.conf'
+        other_file = self.tmp_dir / 'notes.txt'
+        watcher = self.create_watcher(backend_class)
+        try:
+            config_file.write_text("server {\nlisten 80;\n}\n")
+            other_file.write_text("server {\nlisten 80;\n}\n")
+
+            self.assertEqual([config_file], watcher.run_once(timeout=0.1))
+            self.assertEqual("server {\n    listen 80;\n}\n", config_file.read_text())
+            self.assertEqual("server {\nlisten 80;\n}\n", other_file.read_text())
+
+            # own write must not trigger formatting again
+            self.assertEqual([], watcher.run_once(timeout=0.1))
+        finally:
+            watcher.close()
+
+    def test_polling_backend(self):
+        self.check_formats_modified_file(nginxfmt._PollingWatchBackend)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "inotify is available only on Linux")
+    def test_inotify_backend(self):
+        self.check_formats_modified_file(nginxfmt._InotifyWatchBackend)
+
+    def check_write_during_wait_is_debounced(self, backend_class):
+        config_file = self.tmp_dir / 'site.conf'
+        watcher = self.create_watcher(backend_class, debounce=0.4)
+        writer = threading.Timer(0.3, config_file.write_text, ("server {\nlisten 80;\n}\n",))
+        try:
+            writer.start()
+            self.assertEqual([], watcher.run_once(timeout=0.5))
+            writer.join()
+            self.assertEqual("server {\nlisten 80;\n}\n", config_file.read_text())
+
+            formatted = []
+            deadline = time.monotonic() + 5.0
+            while not formatted and time.monotonic() < deadline:
+                formatted = watcher.run_once(timeout=0.1)
+            self.assertEqual([config_file], formatted)
+        finally:
+            watcher.close()
+
+    def test_polling_backend_debounce_during_wait(self):
+        self.check_write_during_wait_is_debounced(nginxfmt._PollingWatchBackend)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "inotify is available only on Linux")
+    def test_inotify_backend_debounce_during_wait(self):
+        self.check_write_during_wait_is_debounced(nginxfmt._InotifyWatchBackend)
+
+    def check_formats_file_in_new_directory(self, backend_class):
+        watcher = self.create_watcher(backend_class)
+        try:
+            config_file = self.tmp_dir / 'sub' / 'nested' / 'a.conf'
+            config_file.parent.mkdir(parents=True)
+            config_file.write_text("server {\nlisten 80;\n}\n")
+
+            formatted = []
+            deadline = time.monotonic() + 5.0
+            while not formatted and time.monotonic() < deadline:
+                formatted = watcher.run_once(timeout=0.1)
+            self.assertEqual([config_file], formatted)
+            self.assertEqual("server {\n    listen 80;\n}\n", config_file.read_text())
+        finally:
+            watcher.close()
+
+    def test_polling_backend_new_directory(self):
+        self.check_formats_file_in_new_directory(nginxfmt._PollingWatchBackend)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "inotify is available only on Linux")
+    def test_inotify_backend_new_directory(self):
+        self.check_formats_file_in_new_directory(nginxfmt._InotifyWatchBackend)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), "inotify is available only on Linux")
+    def test_inotify_backend_watch_failure(self):
+        backend = nginxfmt._InotifyWatchBackend(self.tmp_dir)
+        watcher = nginxfmt.Watcher(self.fmt, self.tmp_dir, debounce=0.0, backend=backend)
+        try:
+            (self.tmp_dir / 'sub').mkdir()
+            with unittest.mock.patch.object(backend._libc, 'inotify_add_watch', return_value=-1), \
+                    self.assertLogs(level='WARNING') as logs:
+                self.assertEqual([], watcher.run_once(timeout=1.0))
+            self.assertIn("Cannot watch", logs.output[0])
+
+            config_file = self.tmp_dir / 'site.conf'
+            config_file.write_text("server {\nlisten 80;\n}\n")
+            self.assertEqual([config_file], watcher.run_once(timeout=1.0))
+        finally:
+            watcher.close()
+
+    def test_crlf_line_endings(self):
+        fmt_options = nginxfmt.FormatterOptions()
+        fmt_options.line_endings = '\r\n'
+        config_file = self.tmp_dir / 'site.conf'
+        watcher = nginxfmt.Watcher(nginxfmt.Formatter(fmt_options), self.tmp_dir, debounce=0.0,
+                                   backend=nginxfmt._PollingWatchBackend(self.tmp_dir))
+        config_file.write_text("server {\nlisten 80;\n}\n")
+        self.assertEqual([config_file], watcher.run_once(timeout=0))
+        self.assertEqual(b"server {\r\n    listen 80;\r\n}\r\n", config_file.read_bytes())
+
+    def test_debounce(self):
+        config_file = self.tmp_dir / 'site.conf'
+        watcher = self.create_watcher(nginxfmt._PollingWatchBackend, debounce=60.0)
+        config_file.write_text("server {\nlisten 80;\n}\n")
+        self.assertEqual([], watcher.run_once(timeout=0))
+        self.assertEqual("server {\nlisten 80;\n}\n", config_file.read_text())
+
+        watcher.debounce = 0.0
+        self.assertEqual([config_file], watcher.run_once(timeout=0))
+
+
+class TwoSpaceFormatter(nginxfmt.Formatter):
+    """Deliberately different engine for differential fuzzing tests."""
+
+    def format_string(self, contents: str) -> str:
+        return super().format_string(contents).replace('    ', '  ')
+
+
+class TestFuzzing(unittest.TestCase):
+
+    def setUp(self) -> None:
+        fmt_options = nginxfmt.FormatterOptions()
+        fmt_options.line_endings = '\n'
+        self.fmt = nginxfmt.Formatter(fmt_options)
+
+    def test_generated_configs(self):
+        inputs = [fuzz_nginxfmt.ConfigGenerator(seed).generate() for seed in range(200)]
+        problems, measurements = fuzz_nginxfmt.run_differential({'reference': self.fmt}, inputs)
+        self.assertEqual([], problems)
+        self.assertEqual(200, len(measurements))
+
+        indented = [i for i, text in enumerate(inputs) if '    ' in self.fmt.format_string(text)]
+        self.assertTrue(indented)
+        other = TwoSpaceFormatter(self.fmt.options)
+        problems, measurements = fuzz_nginxfmt.run_differential({'reference': self.fmt, 'other': other}, inputs)
+        self.assertEqual(["input %d: other differs from reference" % i for i in indented], problems)
+        self.assertEqual(400, len(measurements))
+
+    def test_minified_config(self):
+        minified = fuzz_nginxfmt.make_minified_config(200000)
+        formatted = self.fmt.format_string(minified)
+        self.assertEqual(formatted, self.fmt.format_string(formatted))
+        self.assertTrue(formatted.startswith("http {\n"
+                                             "    server {\n"
+                                             "        listen 443 ssl;\n"
+                                             "        server_name example.com;\n"
+                                             "        add_header Alt-Svc 'h3=\":443\"; ma=86400';\n"
+                                             "        location / {\n"
+                                             "            proxy_pass http://backend;\n"))
+
+    def test_find_slow_inputs(self):
+        measurements = []
+        for index, duration in enumerate((0.02, 0.02, 0.02, 0.5)):
+            m = fuzz_nginxfmt.Measurement('engine', index, 1000)
+            m.duration = duration
+            measurements.append(m)
+        self.assertEqual([3], [m.input_index for m in fuzz_nginxfmt.find_slow_inputs(measurements)])
+
 
 if __name__ == '__main__':
     unittest.main()